@@ -1,8 +1,13 @@
 from arcgis.gis import GIS
 import pandas as pd
+import numpy as np
 from dotenv import load_dotenv
 import os
-from shiny import App, reactive, render, ui
+import csv
+import asyncio
+import time
+from shiny import App, reactive, render, req, ui
+from shiny.types import SilentCancelOutputException, SilentException
 from datetime import date
 import bcrypt
 from utils import (
@@ -10,6 +15,11 @@ from utils import (
     rename_to_match_products,
     rename_to_match_db_columns,
     rename_to_match_inv,
+    read_stock_count,
+    build_desc_index,
+    match_desc,
+    stream_csv,
+    stream_xlsx,
 )
 
 # to deploy
@@ -32,6 +42,24 @@ def get_raw_orders(as_sdf=True):
     return ordersFeatureLayer.query().features
 
 
+def iter_order_pages(where="1=1", order_by="objectid", page_size=500):
+    # yields the orders layer one page at a time instead of pulling every record
+    offset = 0
+    while True:
+        page = ordersFeatureLayer.query(
+            where=where,
+            order_by_fields=order_by,
+            result_offset=offset,
+            result_record_count=page_size,
+            return_all_records=False,
+        ).sdf
+        if page.empty:
+            return
+        yield page
+        # the service may cap the page below page_size so step by what came back
+        offset += len(page)
+
+
 def mark_order_complete(order_id):
     features = get_raw_orders(False)
     order_feature = [f for f in features if f.attributes["objectid"] == order_id][0]
@@ -69,6 +97,21 @@ def log_inventory_change(item, previous_qtys, new_qtys, user):
     result = logFeatureLayer.edit_features(adds=[{'attributes':data}])
     return result
 
+def log_inventory_changes(items, previous_qtys, new_qtys, user):
+    ## same as log_inventory_change but for many items in one edit
+    noww = (
+        pd.to_datetime("now") - pd.Timestamp("1970-01-01")
+    ) // pd.Timedelta("1ms")
+
+    adds = [
+        {'attributes': {'username':user,'item_changed':item,'previous_qty':prev,'new_qty':new,'date_time':noww}}
+        for item, prev, new in zip(items, previous_qtys, new_qtys)
+    ]
+    if not adds:
+        return None
+    result = logFeatureLayer.edit_features(adds=adds)
+    return result
+
 def add_inventory_item(data):
     # shouldn't be needed
     # parameters
@@ -115,6 +158,55 @@ def check_inventory_availability(items_dict, long=False):
     return issues
 
 
+def reconcile_stock_count(path):
+    # compare a physical stock count file (like inventory.csv) with the current inventory
+    # returns the rows that would change and the file rows that could not be used
+    inventory = get_raw_inventory()
+    current = inventory.set_index("LongDesc")["Quantity"].to_dict()
+    desc_index = build_desc_index(current.keys())
+
+    counted = {}
+    file_descs = {}
+    skipped = []
+    # exact rows claim their items before any fuzzy match can take them
+    fuzzy_rows = []
+    for desc, qty in read_stock_count(path):
+        item = match_desc(desc, desc_index, fuzzy=False)
+        if item is None:
+            fuzzy_rows.append((desc, qty))
+        elif item in counted:
+            skipped.append(f"{desc}: {item} was already counted as {file_descs[item]}")
+        else:
+            counted[item] = qty
+            file_descs[item] = desc
+
+    for desc, qty in fuzzy_rows:
+        item = match_desc(desc, desc_index)
+        if item is None:
+            skipped.append(f"{desc}: no matching inventory item")
+        elif item in counted:
+            skipped.append(f"{desc}: {item} was already counted as {file_descs[item]}")
+        else:
+            counted[item] = qty
+            file_descs[item] = desc
+
+    changes = pd.DataFrame(
+        [
+            {
+                "Item Description": item,
+                "In File": file_descs[item],
+                "Current": current[item],
+                "Counted": qty,
+                "Change": qty - current[item],
+            }
+            for item, qty in counted.items()
+            if qty != current[item]
+        ],
+        columns=["Item Description", "In File", "Current", "Counted", "Change"],
+    )
+    return changes.sort_values("Item Description"), skipped
+
+
 def can_complete_order(order_id):
     orders = get_raw_orders().rename(columns=rename_to_match_products)
 
@@ -132,7 +224,158 @@ def can_complete_order(order_id):
     return True, issues
 
 
-def get_nav_items(logged_in):
+def order_demand(orders, inventory):
+    # orders x inventory items matrix of requested quantities, columns follow inventory rows
+    # also flags orders that ask for something with no matching inventory item
+    orders = orders.rename(columns=rename_to_match_products)
+    listed = orders["Products"].fillna("").str.get_dummies(sep=",")
+    col_of = {name: i for i, name in enumerate(inventory["ShortDesc"])}
+    demand = np.zeros((len(orders), len(col_of)))
+    blocked = np.zeros(len(orders), dtype=bool)
+    for product in listed.columns:
+        if product not in orders:
+            # listed but there is no quantity to go by, so it can't be planned
+            blocked |= listed[product].to_numpy(dtype=bool)
+            continue
+        qty = orders[product].fillna(0).to_numpy(dtype=float) * listed[product].to_numpy()
+        inv_name = rename_to_match_inv.get(rename_to_match_db_columns.get(product))
+        if inv_name in col_of:
+            demand[:, col_of[inv_name]] += qty
+        else:
+            blocked |= qty > 0
+    return demand, blocked
+
+
+def plan_fulfilment(orders, inventory, strategy="oldest"):
+    # pick a set of open orders that can all ship from current stock
+    # strategy "oldest" fills orders by Date, "most" fills the smallest orders
+    # (relative to stock) first to get as many orders out as possible
+    orders = orders.loc[orders["status"] == "Open"].reset_index(drop=True)
+    demand, blocked = order_demand(orders, inventory)
+    stock = inventory["Quantity"].fillna(0).clip(lower=0).to_numpy(dtype=float)
+
+    # orders that could not ship even with the whole warehouse to themselves
+    fits = ~blocked & (demand <= stock).all(axis=1)
+    if strategy == "most":
+        priority = np.argsort((demand / np.maximum(stock, 1)).sum(axis=1), kind="stable")
+    else:
+        priority = np.argsort(orders["Date"].to_numpy(), kind="stable")
+
+    remaining = stock.copy()
+    chosen = np.zeros(len(orders), dtype=bool)
+    for i in priority[fits[priority]]:
+        if (demand[i] <= remaining).all():
+            remaining -= demand[i]
+            chosen[i] = True
+
+    planned = (
+        orders.loc[chosen]
+        .rename(
+            columns={
+                "objectid": "Order #",
+                "Namebwe": "Player-Coach",
+            }
+        )
+        .assign(SWE=lambda df_: df_.ReceivingSWE.str.split(" - ").str[-1])
+        .sort_values("Date")
+        .assign(Date=lambda df_: df_.Date.dt.strftime("%d %b, %Y"))
+        .loc[:, ["Order #", "Player-Coach", "Date", "SWE", "Community"]]
+    )
+    picked = demand[chosen].sum(axis=0)
+    pick_list = (
+        pd.DataFrame(
+            {
+                "Item Description": inventory["LongDesc"].to_numpy(),
+                "Pick": picked.astype(int),
+                "In Stock": stock.astype(int),
+                "Left After": remaining.astype(int),
+            }
+        )
+        .loc[lambda df_: df_["Pick"] > 0]
+        .sort_values("Item Description")
+    )
+    return planned, pick_list, int((~chosen).sum())
+
+
+# where clauses the Export tab can ask for
+export_where = {
+    "All": "1=1",
+    "Open": "status = 'Open'",
+    "Completed": "status = 'Completed'",
+}
+
+# product columns in the order they appear in rename_to_match_products
+export_products = list(
+    dict.fromkeys(
+        name for name in rename_to_match_products.values() if name != "order_id"
+    )
+)
+
+
+def iter_order_export(where="1=1"):
+    # orders with product columns under their pretty_names, one page at a time
+    columns = ["Order #", "Player-Coach", "Date", "SWE", "Community", "Status"]
+    columns += [pretty_names.get(name, name) for name in export_products]
+    for page in iter_order_pages(where):
+        yield (
+            page.rename(columns=rename_to_match_products)
+            .rename(
+                columns={
+                    "order_id": "Order #",
+                    "Namebwe": "Player-Coach",
+                    "status": "Status",
+                    **pretty_names,
+                }
+            )
+            .assign(SWE=lambda df_: df_.ReceivingSWE.str.split(" - ").str[-1])
+            .reindex(columns=columns)
+        )
+
+
+def get_swe_names(where="1=1"):
+    # SWE name -> every ReceivingSWE value it appears under (the text before " - " varies)
+    values = ordersFeatureLayer.query(
+        where=where,
+        out_fields="ReceivingSWE",
+        return_distinct_values=True,
+        return_geometry=False,
+    ).sdf["ReceivingSWE"]
+    swe_names = {}
+    for value in sorted(values.dropna()):
+        swe_names.setdefault(value.split(" - ")[-1], []).append(value)
+    return dict(sorted(swe_names.items()))
+
+
+def iter_pick_lists(where="status = 'Open'"):
+    # item totals per SWE, each SWE's orders are paged through on their own so its
+    # pick list is sent as soon as they have been read
+    for swe, receiving in get_swe_names(where).items():
+        quoted = ", ".join("'" + value.replace("'", "''") + "'" for value in receiving)
+        totals = {}
+        for page in iter_order_pages(f"({where}) AND ReceivingSWE IN ({quoted})"):
+            page = page.rename(columns=rename_to_match_products)
+            listed = page["Products"].fillna("").str.get_dummies(sep=",")
+            items = [item for item in listed.columns if item in page]
+            qtys = page[items].fillna(0).mul(listed[items]).sum()
+            for item, qty in qtys.items():
+                if qty > 0:
+                    totals[item] = totals.get(item, 0) + qty
+        if totals:
+            yield pd.DataFrame(
+                {
+                    "SWE": swe,
+                    "Item": [pretty_names.get(item, item) for item in totals],
+                    "Quantity": [int(qty) for qty in totals.values()],
+                }
+            )
+
+
+# panels that stay hidden until the user logs in
+auth_panels = ["Orders", "Fulfilment Planner", "Inventory Management", "Export"]
+
+
+def get_nav_items():
+    # the whole UI is sent once; login only reveals the auth_panels
     items = [
         ui.nav_panel(
             "Login",
@@ -142,60 +385,124 @@ def get_nav_items(logged_in):
                 ui.input_action_button("login", "Login"),
                 ui.output_text("login_message"),
             ),
-        )
-    ]
-
-    if logged_in:
-        items.extend(
-            [
-                ui.nav_panel(
-                    "Orders",
-                    ui.card(
-                        ui.card_header("Order List"),
-                        ui.input_radio_buttons(
-                            "status_filter",
-                            "Filter by Status:",
-                            choices=["All", "Open", "Completed"],
-                            selected="Open",
-                            inline=True,
-                        ),
-                        ui.output_data_frame("order_table"),
-                    ),
-                    ui.card(
-                        ui.card_header("Order Details"),
-                        ui.output_ui("order_details"),
-                        ui.output_ui("order_edit_form"),
-                    ),
+        ),
+        ui.nav_panel(
+            "Orders",
+            ui.card(
+                ui.card_header("Order List"),
+                ui.input_radio_buttons(
+                    "status_filter",
+                    "Filter by Status:",
+                    choices=["All", "Open", "Completed"],
+                    selected="Open",
+                    inline=True,
                 ),
-                # Inventory Tab
-                ui.nav_panel(
-                    "Inventory Management",
-                    ui.card(
-                        ui.card_header("Current Inventory"),
-                        ui.output_data_frame("inventory_table"),
-                    ),
-                    ui.card(
-                        ui.card_header("Update Inventory"),
-                        ui.input_select(
-                            "item_select",
-                            "Select Item",
-                            choices=get_raw_inventory().sort_values('LongDesc')["LongDesc"].tolist(),
-                            width="100%",
-                        ),
-                        ui.input_numeric(
-                            "new_quantity", "New Quantity", value=0, min=0, width="100%"
-                        ),
-                        ui.input_action_button(
-                            "update_inventory", "Update", class_="btn-primary w-100"
-                        ),
+                ui.output_data_frame("order_table"),
+            ),
+            ui.card(
+                ui.card_header("Order Details"),
+                ui.output_ui("order_details"),
+                ui.output_ui("order_edit_form"),
+            ),
+        ),
+        ui.nav_panel(
+            "Fulfilment Planner",
+            ui.card(
+                ui.card_header("Orders That Can Ship Together"),
+                ui.input_radio_buttons(
+                    "plan_strategy",
+                    "Prioritise:",
+                    choices={"oldest": "Oldest orders first", "most": "Most orders filled"},
+                    selected="oldest",
+                    inline=True,
+                ),
+                ui.output_text("plan_summary"),
+                ui.output_data_frame("plan_orders"),
+            ),
+            ui.card(
+                ui.card_header("Pick List"),
+                ui.output_data_frame("plan_pick_list"),
+            ),
+        ),
+        # Inventory Tab
+        ui.nav_panel(
+            "Inventory Management",
+            ui.card(
+                ui.card_header("Current Inventory"),
+                ui.output_data_frame("inventory_table"),
+            ),
+            ui.card(
+                ui.card_header("Update Inventory"),
+                ui.input_select(
+                    "item_select",
+                    "Select Item",
+                    # filled in from the inventory snapshot after login
+                    choices=[],
+                    width="100%",
+                ),
+                ui.input_numeric(
+                    "new_quantity", "New Quantity", value=0, min=0, width="100%"
+                ),
+                ui.input_action_button(
+                    "update_inventory", "Update", class_="btn-primary w-100"
+                ),
+            ),
+            ui.card(
+                ui.card_header("Import Stock Count"),
+                ui.input_file(
+                    "stock_count_file",
+                    "Stock count file (Description;Quantity)",
+                    accept=[".csv", ".txt"],
+                    width="100%",
+                ),
+                ui.output_ui("stock_count_diff"),
+            ),
+        ),
+        ui.nav_panel(
+            "Export",
+            ui.card(
+                ui.card_header("Download Orders"),
+                ui.input_radio_buttons(
+                    "export_data",
+                    "Export:",
+                    choices={"orders": "Orders", "pick_lists": "Pick lists by SWE (open orders)"},
+                    selected="orders",
+                ),
+                # pick lists are always for open orders
+                ui.panel_conditional(
+                    "input.export_data === 'orders'",
+                    ui.input_radio_buttons(
+                        "export_status",
+                        "Orders with Status:",
+                        choices=list(export_where.keys()),
+                        selected="All",
+                        inline=True,
                     ),
                 ),
-            ]
-        )
+                ui.input_radio_buttons(
+                    "export_format",
+                    "Format:",
+                    choices={"csv": "CSV", "xlsx": "Excel"},
+                    selected="csv",
+                    inline=True,
+                ),
+                ui.download_button("export_download", "Download", class_="btn-primary"),
+            ),
+        ),
+    ]
     return items
 
 
-app_ui = ui.output_ui("navbar_container")
+# hides the auth_panels tabs from the first paint; removed from the page on login
+auth_lock = ui.tags.style(
+    "\n".join(
+        f'.navbar .nav-link[data-value="{panel}"] {{ display: none; }}'
+        for panel in auth_panels
+    ),
+    id="auth-lock",
+)
+
+app_ui = ui.page_navbar(*get_nav_items(), id="nav_panel", header=auth_lock)
 
 
 # app_ui = ui.page_navbar(
@@ -260,38 +567,167 @@ def server(input, output, session):
     def icon_img():
         return {"src": "icon.png", "height": "20px"}
 
-    @output
-    @render.ui
-    def navbar_container():
-        return ui.page_navbar(*get_nav_items(logged_in()), id="nav_panel")
+    # data version the login warm-up was fetched at, and when login started / passed
+    warmed_version = reactive.value(None)
+    login_timing = reactive.value(None)
+    warm_up_saved = reactive.value(None)
+
+    # runs while the password is being checked so the first Orders and Inventory
+    # renders come straight from memory
+    @reactive.extended_task
+    async def warm_up():
+        async def timed(func, *args):
+            start = time.perf_counter()
+            result = await asyncio.to_thread(func, *args)
+            return result, time.perf_counter() - start
+
+        (orders, orders_time), (inventory, inventory_time) = await asyncio.gather(
+            timed(get_raw_orders), timed(get_raw_inventory)
+        )
+        # what the first Orders and Inventory renders need; the plan is only for
+        # the planner tab so it stays out of the timings
+        fetched = time.perf_counter()
+        plan = await asyncio.to_thread(plan_fulfilment, orders, inventory)
+        return {
+            "orders": orders,
+            "inventory": inventory,
+            "plan": plan,
+            "fetch_time": orders_time + inventory_time,
+            "finished": fetched,
+        }
+
+    # inventory snapshot shared by the inventory table and the item select,
+    # downloaded in the background so the UI stays responsive after login
+    @reactive.extended_task
+    async def fetch_inventory():
+        return await asyncio.to_thread(get_raw_inventory)
+
+    def warm_result():
+        # the login warm-up, or None if it failed so callers fall back to normal fetches
+        try:
+            return warm_up.result()
+        except (SilentException, SilentCancelOutputException):
+            # still running (or cancelled), wait for it like any other output
+            raise
+        except Exception:
+            return None
+
+    # the warm-up is only served to the first computation of each cached value,
+    # after that edits, filter changes etc. reload from the layers as before
+    served_warm = set()
+
+    def warm_data(name):
+        if name in served_warm or data_version() != warmed_version():
+            return None
+        warm = warm_result()
+        if warm is not None:
+            served_warm.add(name)
+        return warm
+
+    @reactive.effect
+    def refresh_inventory():
+        req(logged_in())
+        version = data_version()
+        if version != warmed_version() or warm_result() is None:
+            fetch_inventory()
+
+    @reactive.calc
+    def cached_orders():
+        req(logged_in())
+        data_version()
+        # the status filter reloads orders, as it did before the cache
+        input.status_filter()
+        warm = warm_data("orders")
+        if warm is not None:
+            return warm["orders"]
+        return get_raw_orders()
+
+    @reactive.calc
+    def cached_inventory():
+        req(logged_in())
+        data_version()
+        warm = warm_data("inventory")
+        if warm is not None:
+            return warm["inventory"]
+        return fetch_inventory.result()
+
+    @reactive.effect
+    def fill_item_select():
+        inventory = cached_inventory()
+        choices = inventory.sort_values('LongDesc')["LongDesc"].tolist()
+        with reactive.isolate():
+            selected = input.item_select()
+        ui.update_select(
+            "item_select",
+            choices=choices,
+            selected=selected if selected in choices else None,
+        )
+
+    @reactive.effect
+    def report_warm_up():
+        warm = warm_result()
+        req(logged_in() and warm is not None)
+        with reactive.isolate():
+            started, checked = login_timing()
+        # without the warm-up the password check, the orders fetch and the inventory
+        # fetch ran one after another, here they overlapped
+        sequential = (checked - started) + warm["fetch_time"]
+        first_paint = max(checked, warm["finished"]) - started
+        warm_up_saved.set(max(sequential - first_paint, 0))
 
     @output
     @render.text
     def login_message():
         if logged_in():
-            return "Logged in successfully!"
+            saved = warm_up_saved()
+            if saved is None:
+                return "Logged in successfully!"
+            return f"Logged in successfully! Loading ahead saved {saved:.1f}s."
         return ""
 
     @reactive.effect
     @reactive.event(input.login)
-    def handle_login():
-        raw_users = get_raw_users(False)
-        user_data = [u for u in raw_users if u.attributes['username'] == input.username()][0] 
+    async def handle_login():
+        if logged_in():
+            # the Login tab stays visible, don't restart (or cancel) the warm-up
+            return
+        started = time.perf_counter()
+        raw_users = await asyncio.to_thread(get_raw_users, False)
+        matches = [u for u in raw_users if u.attributes['username'] == input.username()]
+        if not matches:
+            ui.notification_show("Invalid login credentials!", type="error")
+            return
+        user_data = matches[0]
+        # known user, start loading their first views while the password is checked
+        warmed_version.set(data_version())
+        served_warm.clear()
+        warm_up()
         hashed_password = user_data.attributes['hashed_password']
         permissions = user_data.attributes['permissions']
-        if bcrypt.checkpw(input.password().encode("utf-8"), hashed_password.encode("utf-8")):
+        password_ok = await asyncio.to_thread(
+            bcrypt.checkpw,
+            input.password().encode("utf-8"),
+            hashed_password.encode("utf-8"),
+        )
+        if password_ok:
+            login_timing.set((started, time.perf_counter()))
             logged_in.set(True)
             user_logged_in.set(input.username())
             user_permissions.set(permissions)
+            ui.remove_ui("#auth-lock")
+            for panel in auth_panels:
+                ui.nav_show("nav_panel", panel, select=panel == "Orders")
         else:
+            warm_up.cancel()
             ui.notification_show("Invalid login credentials!", type="error")
 
     @render.data_frame
     def order_table():
         # df = orders_rv.get()
+        req(logged_in())
         data_version()
         df = (
-            get_raw_orders()
+            cached_orders()
             .rename(
                 columns={
                     "objectid": "Order #",
@@ -320,7 +756,7 @@ def server(input, output, session):
         if editing_order():
             return None
 
-        df = get_raw_orders().rename(columns=rename_to_match_products)
+        df = cached_orders().rename(columns=rename_to_match_products)
         if input.status_filter() != "All":
             df = df[df["status"] == input.status_filter()]
 
@@ -378,7 +814,7 @@ def server(input, output, session):
         if not editing_order():
             return None
 
-        df = get_raw_orders().rename(columns=rename_to_match_products)
+        df = cached_orders().rename(columns=rename_to_match_products)
         if input.status_filter() != "All":
             df = df[df["status"] == input.status_filter()]
 
@@ -414,11 +850,14 @@ def server(input, output, session):
     @reactive.effect
     @reactive.event(input.save_changes)
     def handle_save_changes():
+        req(logged_in())
         selected = input.order_table_selected_rows()
         if not selected:
             return None
 
-        df = get_raw_orders().rename(columns=rename_to_match_products)
+        # same frame the table and edit form were built from, so the selected row
+        # is the order being edited; the update itself goes by order_id
+        df = cached_orders().rename(columns=rename_to_match_products)
         if input.status_filter() != "All":
             df = df[df["status"] == input.status_filter()]
 
@@ -456,12 +895,58 @@ def server(input, output, session):
             editing_order.set(False)
             ui.notification_show("No Change to Order", duration=3)
 
+    @render.download(
+        filename=lambda: f"{input.export_data()}_{date.today():%Y%m%d}.{input.export_format()}"
+    )
+    async def export_download():
+        if not logged_in():
+            return
+        if input.export_data() == "pick_lists":
+            frames = iter_pick_lists()
+            sheet_title = "Pick Lists"
+        else:
+            if input.export_status() not in export_where:
+                return
+            frames = iter_order_export(export_where[input.export_status()])
+            sheet_title = "Orders"
+        if input.export_format() == "xlsx":
+            chunks = stream_xlsx(frames, sheet_title)
+        else:
+            chunks = stream_csv(frames)
+        # each page query (and the xlsx build) runs in a worker thread so the
+        # export doesn't hold up every other session
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+
+    @reactive.calc
+    def fulfilment_plan():
+        req(logged_in())
+        if input.plan_strategy() == "oldest":
+            warm = warm_data("plan")
+            if warm is not None:
+                return warm["plan"]
+        return plan_fulfilment(
+            cached_orders(), cached_inventory(), input.plan_strategy()
+        )
+
+    @render.text
+    def plan_summary():
+        planned, _, left_out = fulfilment_plan()
+        return f"{len(planned)} open orders can be completed together, {left_out} would have to wait"
+
+    @render.data_frame
+    def plan_orders():
+        return render.DataTable(fulfilment_plan()[0], height="400px")
+
+    @render.data_frame
+    def plan_pick_list():
+        return render.DataTable(fulfilment_plan()[1], width="600px")
+
     @render.data_frame
     def inventory_table():
-        data_version()
         return render.DataTable(
             (
-                get_raw_inventory()
+                cached_inventory()
                 .sort_values('LongDesc')
                 .loc[:, ["LongDesc", "Quantity"]]
                 .rename(columns={"LongDesc": "Item Description"})
@@ -478,9 +963,80 @@ def server(input, output, session):
             f"Updated {item} quantity to {new_quantity}", type="message", duration=3
         )
 
+    stock_count_changes = reactive.value(None)
+
+    @reactive.effect
+    @reactive.event(input.stock_count_file)
+    def handle_stock_count_upload():
+        req(logged_in())
+        file = input.stock_count_file()
+        if not file:
+            return
+        try:
+            changes, skipped = reconcile_stock_count(file[0]["datapath"])
+        except (ValueError, csv.Error) as e:
+            stock_count_changes.set(None)
+            ui.notification_show(f"Could not read {file[0]['name']}: {e}", type="error")
+            return
+        stock_count_changes.set((changes, skipped))
+
+    @render.ui
+    def stock_count_diff():
+        pending = stock_count_changes()
+        if pending is None:
+            return ui.p("Upload a stock count to compare it with the current inventory")
+        changes, skipped = pending
+        detail_ui = ui.div()
+        if changes.empty:
+            detail_ui.children.append(ui.p("The stock count matches the current inventory"))
+        else:
+            detail_ui.children.extend(
+                [
+                    ui.HTML(changes.to_html(index=False, classes="table table-sm")),
+                    ui.input_action_button(
+                        "apply_stock_count",
+                        f"Apply {len(changes)} changes",
+                        class_="btn-primary w-100",
+                    ),
+                ]
+            )
+        if skipped:
+            detail_ui.children.extend(
+                [
+                    ui.p(ui.strong("Not imported:")),
+                    ui.tags.ul([ui.tags.li(row) for row in skipped]),
+                ]
+            )
+        return detail_ui
+
+    @reactive.effect
+    @reactive.event(input.apply_stock_count)
+    def handle_apply_stock_count():
+        req(logged_in())
+        pending = stock_count_changes()
+        if pending is None or pending[0].empty:
+            return
+        changes = pending[0]
+        items_to_change = dict(
+            zip(changes["Item Description"], changes["Counted"].astype(int).tolist())
+        )
+        # one edit for all the quantities and one for all the log rows
+        _, previous_qtys, new_qtys = change_inventory_qty(items_to_change)
+        log_inventory_changes(
+            list(items_to_change.keys()), previous_qtys, new_qtys, user_logged_in()
+        )
+        stock_count_changes.set(None)
+        data_version.set(data_version() + 1)
+        ui.notification_show(
+            f"Updated {len(items_to_change)} items from the stock count",
+            type="message",
+            duration=3,
+        )
+
     @reactive.effect
     @reactive.event(input.update_inventory)
     def _():
+        req(logged_in())
         item = input.item_select()
         new_quantity = input.new_quantity()
         inv = get_raw_inventory()
@@ -511,6 +1067,7 @@ def server(input, output, session):
     @reactive.effect
     @reactive.event(input.confirm_update)
     def _():
+        req(logged_in())
         update_inventory_count()
         # Increment the reactive value to trigger table refresh
         data_version.set(data_version() + 1)
@@ -526,6 +1083,7 @@ def server(input, output, session):
         @reactive.effect
         @reactive.event(lambda: input[f"complete_{order_id}"]())
         def _():
+            req(logged_in())
             # check to see if order can be fulfilled as is...
             move_forward, issues = can_complete_order(order_id)
             if move_forward:
@@ -574,6 +1132,7 @@ def server(input, output, session):
         @reactive.effect
         @reactive.event(lambda: input[f"confirm_order_{order_id}"]())
         def _():
+            req(logged_in())
             mark_order_complete(order_id)
             orders = get_raw_orders().rename(columns=rename_to_match_products)
 
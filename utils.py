@@ -1,3 +1,11 @@
+import codecs
+import csv
+import difflib
+import re
+import tempfile
+import pandas as pd
+from openpyxl import Workbook
+
 rename_to_match_products = {
     "objectid": "order_id",
     "NoPML1010": "PMLkit1010",
@@ -124,3 +132,133 @@ pretty_names = {
     #  '':'Umbrella, Gift',
     "BrightWaterVeronicaBuckets": "Veronica Bucket, Bright Water",
 }
+
+
+# stock count files (see inventory.csv) are "description;quantity" rows separated by
+# semicolons, with thousands separators and the odd quoted multi-line description
+def normalise_desc(desc):
+    desc = re.sub(r"[^0-9a-z]+", " ", desc.lower())
+    return " ".join(desc.split())
+
+
+def parse_count(qty):
+    # whole numbers only, "12.7" or "1e3" are notes rather than counts
+    qty = qty.strip().replace(",", "").replace(" ", "")
+    if not qty:
+        return None
+    return int(qty)
+
+
+def stock_count_encoding(path, chunk_size=64 * 1024):
+    # counts saved from Excel on Windows are often cp1252 rather than utf-8
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
+        try:
+            while chunk := f.read(chunk_size):
+                decoder.decode(chunk)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "cp1252"
+    return "utf-8-sig"
+
+
+def read_stock_count(path):
+    # yields (description, quantity) one row at a time so big files are never held in memory
+    encoding = stock_count_encoding(path)
+    with open(path, newline="", encoding=encoding, errors="replace") as f:
+        for row in csv.reader(f, delimiter=";"):
+            if len(row) < 2 or not row[0].strip():
+                continue
+            desc = " ".join(row[0].split())
+            try:
+                qty = parse_count(row[1])
+            except ValueError:
+                # header rows or notes in the quantity column
+                continue
+            if qty is None:
+                continue
+            yield desc, qty
+
+
+def build_desc_index(long_descs):
+    # normalised description -> LongDesc, built once per inventory snapshot
+    return {normalise_desc(desc): desc for desc in long_descs}
+
+
+def tokens_covered(index_key, key, cutoff):
+    # every word of the inventory description has a close match in the file description
+    words = key.split()
+    return all(
+        difflib.get_close_matches(token, words, n=1, cutoff=cutoff)
+        for token in index_key.split()
+    )
+
+
+def numbers_agree(index_key, key):
+    # years and editions tell variants apart ("Calendar, 2025" vs 2026), so numbers
+    # must match exactly; an inventory name without numbers can take any
+    index_numbers = {token for token in index_key.split() if token.isdigit()}
+    numbers = {token for token in key.split() if token.isdigit()}
+    return not index_numbers or index_numbers == numbers
+
+
+def match_desc(desc, desc_index, cutoff=0.8, fuzzy=True, margin=0.05):
+    key = normalise_desc(desc)
+    if key in desc_index:
+        return desc_index[key]
+    if not fuzzy:
+        return None
+    candidates = [index_key for index_key in desc_index if numbers_agree(index_key, key)]
+    scores = sorted(
+        (
+            (difflib.SequenceMatcher(None, key, index_key).ratio(), index_key)
+            for index_key in candidates
+        ),
+        reverse=True,
+    )
+    scores = [(score, index_key) for score, index_key in scores if score >= cutoff]
+    if scores:
+        if len(scores) > 1 and scores[0][0] - scores[1][0] < margin:
+            # ambiguous, leave it for a person to sort out
+            return None
+        return desc_index[scores[0][1]]
+    # word by word, for extras like "(10-Pack)" and typos like "Pippettes"
+    covered = [
+        index_key for index_key in candidates if tokens_covered(index_key, key, cutoff)
+    ]
+    if not covered:
+        return None
+    most_words = max(len(index_key.split()) for index_key in covered)
+    best = [index_key for index_key in covered if len(index_key.split()) == most_words]
+    if len(best) > 1:
+        # ambiguous, leave it for a person to sort out
+        return None
+    return desc_index[best[0]]
+
+
+# exports are written one chunk (DataFrame) at a time so memory stays flat
+def stream_csv(frames):
+    header = True
+    for frame in frames:
+        yield frame.to_csv(index=False, header=header)
+        header = False
+
+
+def stream_xlsx(frames, sheet_title="Export", chunk_size=64 * 1024):
+    # xlsx is a zip so it can't go out until it is finished (the whole build happens on
+    # the first next()), but a write-only workbook spools rows to disk instead of
+    # keeping them in memory
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+    header = True
+    for frame in frames:
+        if header:
+            ws.append(list(frame.columns))
+            header = False
+        for row in frame.itertuples(index=False):
+            ws.append([None if pd.isna(value) else value for value in row])
+    with tempfile.TemporaryFile() as f:
+        wb.save(f)
+        f.seek(0)
+        while chunk := f.read(chunk_size):
+            yield chunk